@@ -6,121 +6,750 @@
 - basic: весь файл в памяти (set), для объёма до ~10^6 строк
 - optimized: разбиение по хешу на партиции, потоковое чтение, для больших файлов
   при ограничении RAM ~1 ГБ
+- hybrid: то же разбиение по хешу, но в памяти, без временных файлов, в одном
+  процессе — для файлов, которые с запасом помещаются в свободную память, когда
+  воркер всего один
+- sort: внешняя сортировка — отсортированные прогоны на диске и их слияние,
+  только последовательный ввод-вывод (выбирается флагом)
 
-Выбор режима автоматически по размеру файла (порог 50 МБ) или вручную через флаги.
+Выбор режима автоматически по размеру файла (порог 50 МБ) и свободной памяти
+или вручную через флаги.
 """
 import argparse
+import ctypes
 import hashlib
-import ipaddress
+import heapq
+import mmap
 import os
+import socket
+import statistics
 import tempfile
-from concurrent.futures import ProcessPoolExecutor, as_completed
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import resource  # Только POSIX
+except ImportError:
+    resource = None
 
 
 # Порог 50 МБ (~10^6 строк) для переключения на режим партиций
 MEMORY_MODE_THRESHOLD = 50 * 1024 * 1024
-NUM_PARTITIONS = 4096
+# hybrid выбирается, если размер файла × HYBRID_MEMORY_FACTOR меньше свободной памяти
+HYBRID_MEMORY_FACTOR = 3
+# Число партиций — степень двойки (номер — младшие биты хеша) в пределах
+# [MIN_PARTITIONS, MAX_PARTITIONS], примерно по PARTITION_INPUT_SIZE входных данных на партицию
+MIN_PARTITIONS = 64
+MAX_PARTITIONS = 4096
+PARTITION_INPUT_SIZE = 16 * 1024 * 1024  # ~400 тыс. строк: до ~40 МБ в set воркера
+# Партиция больше медианы в SKEW_FACTOR раз дробится перед фазой 2 (не более чем на MAX_SPLIT)
+SKEW_FACTOR = 2
+MAX_SPLIT = 64
 CHUNK_WRITE_SIZE = 8 * 1024 * 1024  # Размер буфера при записи партиций
+PARTITION_READ_SIZE = 1024 * 1024  # Блок чтения файла партиции, кратен 16
+INPUT_CHUNK_SIZE = 1024 * 1024  # Блок входного файла, выровненный по '\n' (~26 тыс. строк)
+_SIMD_PADDING = 48  # parse_batch читает строку тремя 16-байтовыми загрузками
+RECENT_KEYS = 1 << 16  # Окно отсева повторов в фазе 1 (степень двойки)
+RECENT_SAMPLE = 512  # Ключей пробы попаданий в окно в начале блока (путь без C-библиотеки)
+CANON_CACHE_SIZE = 1 << 16  # Записей в кеше разбора строк (путь без C-библиотеки)
+CANON_CACHE_SAMPLE = 512  # Строк пробы попаданий в кеш в начале блока
+SORT_RUN_KEYS = 1 << 20  # Наибольший прогон, ключей (~130 МБ в set)
+# Память режима sort на все воркеры: фаза 1 — set прогона, фаза 2 — блоки чтения прогонов
+SORT_MEMORY_BUDGET = 512 * 1024 * 1024
+SORT_KEY_COST = 128  # Байт на ключ прогона: объект bytes, ячейка set, список sorted, join
+SORT_SAMPLES_PER_RUN = 64  # Выборка из прогона для выбора границ диапазонов слияния
+
+
+def _canon(line: str) -> bytes:
+    """Разбор IPv6 в 16 байт адреса (network order) через socket.inet_pton (реализован в C).
+    Понимает все формы записи, включая '::' и IPv4-суффикс (::ffff:1.2.3.4).
+    """
+    try:
+        return socket.inet_pton(socket.AF_INET6, line)
+    except OSError:
+        raise ValueError(f"Некорректный IPv6-адрес: {line!r}") from None
+
+
+# Строка адреса (str) -> ключ. Очищается целиком при переполнении: дешевле учёта
+# порядка использования, а горячие адреса возвращаются в кеш за один блок
+_CANON_CACHE = {}
+
+
+def _canon_line(line: bytes) -> bytes:
+    """_canon для сырой строки bytes."""
+    return _canon(line.decode('ascii', errors='replace'))
+
+
+def _load_simd():
+    """Необязательное C-расширение _ipv6_simd.so (сборка — в _ipv6_simd.c).
+    Если библиотека не собрана или собрана из старой версии без нужных функций,
+    разбор идёт через _canon (inet_pton): библиотека не в git, и устаревшая сборка
+    рядом со скриптом не должна ломать запуск.
+    """
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '_ipv6_simd.so')
+    try:
+        lib = ctypes.CDLL(path)
+        _bind_simd(lib)
+    except (OSError, AttributeError):
+        return None
+    return lib
+
+
+def _bind_simd(lib) -> None:
+    """Сигнатуры функций библиотеки; AttributeError, если какой-то функции нет."""
+    lib.parse_batch.argtypes = (ctypes.c_void_p, ctypes.c_size_t, ctypes.c_void_p)
+    lib.parse_batch.restype = ctypes.c_size_t
+    lib.set16_new.argtypes = (ctypes.c_size_t,)
+    lib.set16_new.restype = ctypes.c_void_p
+    lib.set16_add.argtypes = (ctypes.c_void_p, ctypes.c_char_p, ctypes.c_size_t)
+    lib.set16_add.restype = ctypes.c_int
+    lib.set16_size.argtypes = (ctypes.c_void_p,)
+    lib.set16_size.restype = ctypes.c_size_t
+    lib.set16_free.argtypes = (ctypes.c_void_p,)
+    lib.set16_free.restype = None
+    lib.scatter16.argtypes = (ctypes.c_char_p, ctypes.c_size_t, ctypes.c_uint,
+                              ctypes.c_uint32, ctypes.c_void_p, ctypes.c_void_p)
+    lib.scatter16.restype = ctypes.c_int
+    lib.dedup16.argtypes = (ctypes.c_void_p, ctypes.c_size_t, ctypes.c_char_p,
+                            ctypes.c_size_t, ctypes.c_void_p)
+    lib.dedup16.restype = ctypes.c_size_t
+
+
+_SIMD = _load_simd()
+
+
+def _canon_batch(lines: list) -> bytes:
+    """Разбор пачки адресов (без пробельных символов) в блок 16-байтовых ключей подряд.
+    С C-библиотекой строки — bytes; строки, которые C-код не принял (IPv4-суффикс,
+    ошибка записи), разбирает _canon — он же сообщает об ошибке. Без неё строки — str
+    (блок декодирован целиком в _iter_key_blocks) и сразу идут в _canon.
+    """
+    if _SIMD is None:
+        # Популярные адреса во входе с перекосом повторяются и между блоками:
+        # разбираются только строки, которых ещё нет в кеше
+        cache = _CANON_CACHE
+        if len(cache) > CANON_CACHE_SIZE:
+            cache.clear()
+        # Проба по началу блока: на входе почти без повторов промах кеша дороже
+        # разбора, тогда кеш только пополняется пробой и прогревается к перекосу
+        sample = lines[:CANON_CACHE_SAMPLE]
+        missing = [line for line in sample if line not in cache]
+        cache.update(zip(missing, map(_canon, missing)))
+        if 2 * len(missing) > len(sample):
+            return b''.join(map(cache.__getitem__, sample)) + \
+                b''.join(map(_canon, lines[CANON_CACHE_SAMPLE:]))
+        missing = [line for line in lines if line not in cache]
+        cache.update(zip(missing, map(_canon, missing)))
+        return b''.join(map(cache.__getitem__, lines))
+    n = len(lines)
+    data = b'\n'.join(lines) + b'\n'
+    buf = ctypes.create_string_buffer(data, len(data) + _SIMD_PADDING)
+    out = ctypes.create_string_buffer(16 * n)
+    src, dst = ctypes.addressof(buf), ctypes.addressof(out)
+    done = pos = 0
+    while True:
+        parsed = _SIMD.parse_batch(src + pos, n - done, dst + 16 * done)
+        if done + parsed == n:
+            break
+        pos += sum(map(len, lines[done:done + parsed])) + parsed
+        done += parsed
+        ctypes.memmove(dst + 16 * done, _canon_line(lines[done]), 16)
+        pos += len(lines[done]) + 1
+        done += 1
+    return out.raw
+
+
+def _iter_chunks(mm, start: int, end: int):
+    """Блоки mm[start:end] по ~INPUT_CHUNK_SIZE, выровненные по концам строк."""
+    while start < end:
+        stop = start + INPUT_CHUNK_SIZE
+        if stop < end:
+            nl = mm.find(b'\n', stop, end)
+            stop = end if nl < 0 else nl + 1
+        else:
+            stop = end
+        yield mm[start:stop]
+        start = stop
+
+
+def _align_to_line(mm, pos: int, size: int) -> int:
+    """Начало строки, следующей за той, что содержит байт pos - 1 (0 и size — как есть).
+    Строка относится к диапазону, в котором лежит её первый байт.
+    """
+    if pos <= 0 or pos >= size:
+        return max(0, min(pos, size))
+    nl = mm.find(b'\n', pos - 1)
+    return size if nl < 0 else nl + 1
+
+
+# Пробельные символы, кроме концов строк (для str.split() — и \x1c-\x1f): без них в блоке
+# split() режет только по \n и \r, то есть совпадает с построчным strip().
+# Проверка — поиском каждого байта (memchr), регулярное выражение заметно медленнее
+_INNER_SPACE = tuple(bytes([c]) for c in b' \t\x0b\x0c\x1c\x1d\x1e\x1f')
+
+
+def _split_lines(chunk: bytes, decode: bool = False) -> list:
+    """Непустые строки блока с обрезанными краями — как построчный strip():
+    адрес с пробелом внутри ('1::2 3::4') остаётся одной строкой и отклоняется при
+    разборе, а не считается двумя адресами. decode — строки str вместо bytes.
+    Обычный блок без пробелов и табуляций режется одним split(); иначе — splitlines()
+    и strip() каждой строки.
+    """
+    if not any(c in chunk for c in _INNER_SPACE):
+        return (chunk.decode('ascii', errors='replace') if decode else chunk).split()
+    lines = [line for line in (raw.strip() for raw in chunk.splitlines()) if line]
+    if decode:
+        return [line.decode('ascii', errors='replace') for line in lines]
+    return lines
+
+
+def _iter_key_blocks(input_path: str, start: int = 0, end: int = None):
+    """Чтение входного файла через mmap: по блоку входных данных — блок ключей
+    (16-байтовые ключи подряд, см. _canon_batch).
+    Строки выделяются _split_lines — обычно одним split() целого блока, без построчных
+    strip(); без C-библиотеки такой блок сначала декодируется целиком, и на строку
+    приходится один str вместо bytes и его decode() для inet_pton.
+    Диапазон [start, end) выравнивается по строкам (_align_to_line), так что соседние
+    диапазоны делят файл без пропусков и повторов.
+    Все потребители считают уникальные, поэтому повторы внутри блока могут быть отброшены:
+    без C-разбора одинаковые строки отсеиваются до inet_pton (set из декодированных
+    строк str дешевле разбора), с ним разбор дешевле такого отсева.
+    """
+    with open(input_path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if not size:
+            return  # mmap не отображает пустые файлы
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if hasattr(mmap, 'MADV_SEQUENTIAL'):
+                mm.madvise(mmap.MADV_SEQUENTIAL)
+            start = _align_to_line(mm, start, size)
+            end = _align_to_line(mm, size if end is None else end, size)
+            for chunk in _iter_chunks(mm, start, end):
+                if _SIMD is None:
+                    lines = list(set(_split_lines(chunk, decode=True)))
+                else:
+                    lines = _split_lines(chunk)
+                if lines:
+                    yield _canon_batch(lines)
+
+
+def _md5_hash(key: bytes) -> int:
+    """32-битный хеш ключа по MD5 (режим --stable-hash): первые 4 байта digest()."""
+    return int.from_bytes(hashlib.md5(key).digest()[:4], 'big')
+
+
+def _new_recent():
+    """Окно недавних ключей для _drop_recent: кеш C-библиотеки или set."""
+    if _SIMD is None:
+        return set()
+    return ctypes.create_string_buffer(16 * RECENT_KEYS)
+
+
+def _drop_recent(block: bytes, recent) -> bytes:
+    """Убирает из блока ключи, недавно уже отправленные в партиции.
+    Горячие адреса во входе с перекосом иначе пишутся на диск миллионы раз. Окно
+    ограничено RECENT_KEYS: проскочивший повтор снимается при подсчёте, точность не страдает.
+    Без C-библиотеки окно — цикл интерпретатора по ключам, и на входе почти без
+    повторов он дороже сэкономленной записи: как в _canon_batch, сначала проба по
+    началу блока, и при большинстве промахов блок отдаётся как есть.
+    """
+    if _SIMD is None:
+        if len(recent) > RECENT_KEYS:
+            recent.clear()
+        fresh = []
+        probe = min(len(block), 16 * RECENT_SAMPLE)
+        for i in range(0, len(block), 16):
+            if i == probe and 2 * len(fresh) > RECENT_SAMPLE:
+                return b''.join(fresh) + block[probe:]
+            key = block[i:i + 16]
+            if key not in recent:
+                recent.add(key)
+                fresh.append(key)
+        return b''.join(fresh)
+    out = ctypes.create_string_buffer(len(block))
+    kept = _SIMD.dedup16(recent, RECENT_KEYS - 1, block, len(block) // 16, out)
+    return out.raw[:16 * kept]
+
+
+def _scatter_block(block: bytes, num_partitions: int, stable_hash: bool = False,
+                   shift: int = 0) -> list:
+    """Раскладка блока ключей по партициям: список пар (номер партиции, ключи подряд).
+    Номер — биты хеша начиная с shift (shift > 0 — дробление уже выделенной партиции).
+    hash() в Python не детерминирован между процессами; CRC32 стабилен и на порядок
+    дешевле MD5. MD5 — равномерное распределение для любых входных данных.
+    С C-библиотекой CRC32 и группировка по партициям идут в scatter16 — без цикла
+    интерпретатора по ключам.
+    """
+    mask = num_partitions - 1
+    if stable_hash or _SIMD is None:
+        part_hash = _md5_hash if stable_hash else zlib.crc32
+        return [(part_hash(key) >> shift & mask, key)
+                for key in (block[i:i + 16] for i in range(0, len(block), 16))]
+    out = ctypes.create_string_buffer(len(block))
+    counts = (ctypes.c_uint32 * num_partitions)()
+    if _SIMD.scatter16(block, len(block) // 16, shift, mask, out, counts) < 0:
+        raise MemoryError("Недостаточно памяти для раскладки ключей")
+    raw = out.raw
+    groups = []
+    pos = 0
+    for pid, count in enumerate(counts):
+        if count:
+            groups.append((pid, raw[pos:pos + 16 * count]))
+            pos += 16 * count
+    return groups
+
+
+def _num_partitions(input_size: int, num_workers: int) -> int:
+    """Число партиций для файла размера input_size.
+    Не меньше 4 на воркер (балансировка) и не крупнее PARTITION_INPUT_SIZE (лимит памяти);
+    лишние партиции только дробят буферы записи и держат открытыми тысячи файлов.
+    """
+    need = max(MIN_PARTITIONS, 4 * num_workers, -(-input_size // PARTITION_INPUT_SIZE))
+    return min(MAX_PARTITIONS, 1 << (need - 1).bit_length())
+
+
+def _resolve_workers(num_workers: int) -> int:
+    """Число воркеров: заданное или cpu_count() - 1 (система остаётся отзывчивой)."""
+    return num_workers or max(1, (os.cpu_count() or 1) - 1)
 
 
-def ipv6_to_canonical(addr_str: str) -> str:
-    """Приводит IPv6 к канонической форме: 8 групп по 4 hex, lowercase, разделитель ':'
-    Пример: 2001:db0::30 -> 2001:0db0:0000:0000:0000:0000:0000:0030
+# Лимит и текущее потребление памяти cgroup: v2, затем v1
+_CGROUP_MEMORY_FILES = (
+    ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory.current'),
+    ('/sys/fs/cgroup/memory/memory.limit_in_bytes', '/sys/fs/cgroup/memory/memory.usage_in_bytes'),
+)
+
+
+def _cgroup_memory_left():
+    """Остаток лимита памяти cgroup в байтах; None, если лимита нет или он неизвестен."""
+    for limit_path, usage_path in _CGROUP_MEMORY_FILES:
+        try:
+            with open(limit_path) as f:
+                limit = f.read().strip()
+            with open(usage_path) as f:
+                usage = int(f.read())
+        except (OSError, ValueError):
+            continue
+        # 'max' в v2 и число около 2^63 в v1 — лимит не задан
+        if limit == 'max' or int(limit) >= 1 << 60:
+            return None
+        return max(0, int(limit) - usage)
+    return None
+
+
+def _available_memory() -> int:
+    """Память в байтах, доступная процессу: свободная физическая (sysconf), но не больше
+    остатка лимита cgroup и RLIMIT_AS — в контейнере свободная память узла намного
+    больше разрешённой. 0, если свободную физическую память система не сообщает.
+    """
+    try:
+        available = os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return 0
+    cgroup_left = _cgroup_memory_left()
+    if cgroup_left is not None:
+        available = min(available, cgroup_left)
+    if resource is not None:
+        soft, _ = resource.getrlimit(resource.RLIMIT_AS)
+        if soft != resource.RLIM_INFINITY:
+            available = min(available, soft)
+    return available
+
+
+def _iter_file_blocks(paths: list):
+    """Содержимое файлов блоками по PARTITION_READ_SIZE байт."""
+    for path in paths:
+        with open(path, 'rb') as f:
+            while True:
+                block = f.read(PARTITION_READ_SIZE)
+                if not block:
+                    break
+                yield block
+
+
+def _count_unique_blocks(blocks, capacity: int = 0) -> int:
+    """Число различных 16-байтовых ключей в потоке блоков (длина блока кратна 16).
+    С C-библиотекой ключи идут в её хеш-таблицу (set16_*): без цикла интерпретатора
+    и объектов bytes на ключ. Иначе — set из срезов блока.
+    capacity — верхняя граница числа ключей (если известна, например из размеров
+    файлов): таблица C-библиотеки создаётся сразу нужного размера, без перестроек.
     """
-    addr = ipaddress.IPv6Address(addr_str.strip())
-    return addr.exploded.lower()
+    if _SIMD is None:
+        unique = set()
+        for block in blocks:
+            unique.update(block[i:i + 16] for i in range(0, len(block), 16))
+        return len(unique)
+    table = _SIMD.set16_new(capacity)
+    if not table:
+        raise MemoryError("Недостаточно памяти для таблицы ключей")
+    try:
+        for block in blocks:
+            if _SIMD.set16_add(table, block, len(block) // 16) < 0:
+                raise MemoryError("Недостаточно памяти для таблицы ключей")
+        return _SIMD.set16_size(table)
+    finally:
+        _SIMD.set16_free(table)
 
 
-def count_unique_in_partition(partition_path: str) -> int:
-    """Подсчёт уникальных строк в одном файле партиции.
-    Вызывается воркерами при параллельной обработке. Строки уже в канонической форме.
+def count_unique_in_partition(partition_paths: list, size: int = 0) -> int:
+    """Подсчёт уникальных адресов в одной партиции — объединение её файлов от всех воркеров.
+    Вызывается воркерами при параллельной обработке. Файлы — записи фиксированной длины
+    по 16 байт; читаются блоками, так что кроме множества ключей в памяти только
+    текущий блок, а не вся партиция со всеми повторами. size — суммарный размер
+    файлов: size // 16 записей — точная верхняя граница числа ключей для таблицы.
     """
-    unique = set()
-    with open(partition_path, 'r', encoding='utf-8', errors='replace') as f:
-        for line in f:
-            line = line.strip()
-            if line:
-                unique.add(line)
-    return len(unique)
+    return _count_unique_blocks(_iter_file_blocks(partition_paths), size // 16)
 
 
 def count_unique_basic(input_path: str) -> int:
-    """Базовый режим: построчное чтение файла, нормализация адресов, хранение в set.
+    """Базовый режим: построчное чтение файла, нормализация адресов, хранение в set
+    (с C-библиотекой — в её хеш-таблице, см. _count_unique_blocks).
     Предназначен для файлов до ~10^6 строк, помещающихся в оперативную память.
     """
-    unique = set()
-    with open(input_path, 'r', encoding='utf-8', errors='replace') as f:
-        for line in f:
-            line = line.strip()
-            if line:
-                canonical = ipv6_to_canonical(line)
-                unique.add(canonical)
-    return len(unique)
+    return _count_unique_blocks(_iter_key_blocks(input_path))
 
 
-def count_unique_optimized(input_path: str, temp_dir: str, num_workers: int = 0) -> int:
-    """Оптимизированный режим для больших файлов.
+def _partition_path(temp_dir: str, pid: int, worker_id: int) -> str:
+    """Файл партиции pid, записанный воркером worker_id в фазе 1."""
+    return os.path.join(temp_dir, f"part_{pid:04d}_{worker_id:03d}.bin")
 
-    Алгоритм:
-    1. Потоковое чтение, нормализация, разбиение по MD5-хешу в NUM_PARTITIONS файлов
-    2. Параллельный подсчёт уникальных в каждой партиции (ProcessPoolExecutor)
-    3. Сумма результатов
-
-    В памяти одновременно только одна партиция — соблюдается лимит RAM.
-    """
-    num_workers = num_workers or max(1, os.cpu_count() - 1)
-    partition_paths = [
-        os.path.join(temp_dir, f"part_{i:04d}.txt")
-        for i in range(NUM_PARTITIONS)
-    ]
-    for p in partition_paths:
-        open(p, 'w').close()
-
-    # Фаза 1: разбиение по партициям
-    partition_files = [open(p, 'a', encoding='utf-8') for p in partition_paths]
+
+def _scatter_blocks(blocks, paths: list, stable_hash: bool = False, shift: int = 0) -> None:
+    """Раскладка потока блоков ключей по файлам paths (по файлу на партицию).
+    Ключи копятся в памяти и выгружаются блоками по CHUNK_WRITE_SIZE — меньше
+    обращений к диску. Буфер партиции — один непрерывный bytearray, так что выгрузка —
+    один write; буферы крупнее буфера файла уходят в ОС без копирования.
+    """
+    num_partitions = len(paths)
+    partition_files = []
     try:
-        buffer = [[] for _ in range(NUM_PARTITIONS)]
+        for path in paths:
+            partition_files.append(open(path, 'wb'))
+        # Буфер партиции — один bytearray на всё время раскладки: без списка объектов
+        # на каждую группу ключей и без новых списков после каждой выгрузки
+        buffer = [bytearray() for _ in range(num_partitions)]
         buffer_size = 0
 
-        with open(input_path, 'r', encoding='utf-8', errors='replace') as f:
-            for line in f:
-                line = line.strip()
-                if not line:
-                    continue
-                canonical = ipv6_to_canonical(line)
-                # hash() в Python не детерминирован между запусками; MD5 даёт стабильное распределение
-                h = int(hashlib.md5(canonical.encode()).hexdigest()[:8], 16)
-                idx = h % NUM_PARTITIONS
-                buffer[idx].append(canonical + '\n')
-                buffer_size += len(canonical) + 1
-
-                if buffer_size >= CHUNK_WRITE_SIZE:
-                    for i, fh in enumerate(partition_files):
-                        if buffer[i]:
-                            fh.writelines(buffer[i])
-                            buffer[i] = []
-                    buffer_size = 0
+        for block in blocks:
+            for idx, keys in _scatter_block(block, num_partitions, stable_hash, shift):
+                buffer[idx] += keys
+            buffer_size += len(block)
+
+            if buffer_size >= CHUNK_WRITE_SIZE:
+                for i, fh in enumerate(partition_files):
+                    if buffer[i]:
+                        fh.write(buffer[i])
+                        buffer[i].clear()
+                buffer_size = 0
 
         for i, fh in enumerate(partition_files):
             if buffer[i]:
-                fh.writelines(buffer[i])
+                fh.write(buffer[i])
     finally:
         for fh in partition_files:
             fh.close()
 
-    # Фаза 2: параллельный подсчёт уникальных по партициям
+
+def _scatter_range(input_path: str, start: int, end: int, temp_dir: str, worker_id: int,
+                   num_partitions: int, stable_hash: bool = False) -> None:
+    """Фаза 1 для диапазона байт [start, end) входного файла.
+    Нормализует адреса и раскладывает 16-байтовые ключи по собственным файлам воркера
+    part_{pid}_{worker_id}.bin — воркеры не делят открытые файлы.
+    """
+    recent = _new_recent()
+    blocks = (_drop_recent(block, recent)
+              for block in _iter_key_blocks(input_path, start, end))
+    paths = [_partition_path(temp_dir, pid, worker_id) for pid in range(num_partitions)]
+    _scatter_blocks(blocks, paths, stable_hash)
+
+
+def _split_partition(paths: list, temp_dir: str, pid: int, parts: int, shift: int,
+                     stable_hash: bool = False) -> list:
+    """Дробление перегруженной партиции pid на parts частей по битам хеша начиная с shift.
+    Ключи одной части не встречаются в других, так что уникальные считаются по частям
+    независимо. Исходные файлы удаляются; возвращаются пары (файл части, размер).
+    """
+    sub_paths = [os.path.join(temp_dir, f"part_{pid:04d}_s{j:03d}.bin") for j in range(parts)]
+    _scatter_blocks(_iter_file_blocks(paths), sub_paths, stable_hash, shift)
+    for path in paths:
+        os.remove(path)
+    sub_sizes = [(p, os.path.getsize(p)) for p in sub_paths]
+    return [(p, size) for p, size in sub_sizes if size]
+
+
+def _scan_partitions(temp_dir: str, num_partitions: int) -> tuple:
+    """Непустые файлы фазы 1 по партициям за один проход os.scandir: список файлов
+    берётся из каталога, а не строится из num_partitions * num_workers путей.
+    На Linux размер — всё равно stat на файл (DirEntry.stat), на Windows приходит
+    вместе со списком. Возвращает (списки файлов по партициям, суммарные размеры).
+    """
+    partitions = [[] for _ in range(num_partitions)]
+    sizes = [0] * num_partitions
+    with os.scandir(temp_dir) as entries:
+        for entry in entries:
+            if not entry.name.startswith('part_'):
+                continue
+            size = entry.stat().st_size
+            if size:
+                pid = int(entry.name[5:9])  # part_{pid:04d}_{worker_id:03d}.bin
+                partitions[pid].append(entry.path)
+                sizes[pid] += size
+    return partitions, sizes
+
+
+def _rebalance(executor, partitions: list, sizes: list, shift: int, temp_dir: str,
+               stable_hash: bool = False) -> list:
+    """Выравнивание нагрузки фазы 2: партиции крупнее медианы в SKEW_FACTOR раз
+    дробятся на части (параллельно, в executor). partitions — списки файлов по
+    партициям, индекс в списке — номер партиции, sizes — их размеры.
+    Возвращает пары (файлы группы, их размер) для подсчёта, от самой крупной группы
+    к самой мелкой: крупные
+    задачи уходят воркерам первыми, и под конец фазы не остаётся одной длинной (LPT).
+    """
+    nonempty = [size for size in sizes if size]
+    if not nonempty:
+        return []
+    limit = SKEW_FACTOR * statistics.median(nonempty)
+    groups, split_args = [], []
+    for pid, (paths, size) in enumerate(zip(partitions, sizes)):
+        if size > limit:
+            parts = min(MAX_SPLIT, 1 << (-(-size // int(limit)) - 1).bit_length())
+            split_args.append((paths, temp_dir, pid, parts, shift, stable_hash))
+        elif size:
+            groups.append((size, paths))
+    if split_args:
+        for sub_parts in executor.map(_split_partition, *zip(*split_args)):
+            groups.extend((size, [p]) for p, size in sub_parts)
+    groups.sort(key=lambda group: group[0], reverse=True)
+    return [(paths, size) for size, paths in groups]
+
+
+def count_unique_hybrid(input_path: str, stable_hash: bool = False) -> int:
+    """Режим без диска для файлов, помещающихся в память с запасом.
+
+    Один проход раскладывает ключи по CRC32 (MD5 при stable_hash) в корзины-bytearray
+    (16 байт на строку, без объектов на ключ), затем уникальные считаются по корзинам
+    по очереди: множество одной корзины невелико, а обработанная корзина сразу
+    освобождается. Работает в одном процессе — при нескольких воркерах режим
+    партиций параллелен и быстрее.
+    """
+    num_partitions = _num_partitions(os.path.getsize(input_path), 1)
+    buckets = [bytearray() for _ in range(num_partitions)]
+    recent = _new_recent()
+    for block in _iter_key_blocks(input_path):
+        block = _drop_recent(block, recent)
+        for idx, keys in _scatter_block(block, num_partitions, stable_hash):
+            buckets[idx] += keys
+
     total = 0
+    for i in range(num_partitions):
+        bucket, buckets[i] = buckets[i], None
+        if not bucket:
+            continue
+        # C-таблица читает bytearray на месте; set на Python — из срезов bytes
+        keys = (ctypes.c_char * len(bucket)).from_buffer(bucket) if _SIMD else bytes(bucket)
+        total += _count_unique_blocks([keys], len(bucket) // 16)
+        del keys, bucket
+    return total
+
+
+def count_unique_optimized(input_path: str, temp_dir: str, num_workers: int = 0,
+                           stable_hash: bool = False) -> int:
+    """Оптимизированный режим для больших файлов.
+
+    Алгоритм:
+    1. Файл делится на num_workers диапазонов байт; каждый воркер нормализует свой
+       диапазон и раскладывает ключи по CRC32 (MD5 при stable_hash) в свои файлы
+       партиций (число партиций — _num_partitions)
+    2. Партиции, намного крупнее медианы, дробятся по следующим битам хеша (_rebalance)
+    3. Параллельный подсчёт уникальных в каждой партиции по файлам всех воркеров
+    4. Сумма результатов
+
+    В памяти одновременно только одна партиция на воркер — соблюдается лимит RAM.
+    """
+    num_workers = _resolve_workers(num_workers)
+    input_size = os.path.getsize(input_path)
+    num_partitions = _num_partitions(input_size, num_workers)
+    bounds = [input_size * i // num_workers for i in range(num_workers + 1)]
+
     with ProcessPoolExecutor(max_workers=num_workers) as executor:
-        futures = {
-            executor.submit(count_unique_in_partition, p): p
-            for p in partition_paths if os.path.getsize(p) > 0
-        }
-        for future in as_completed(futures):
-            total += future.result()
+        # Фаза 1: параллельное разбиение по партициям
+        scatter = [
+            executor.submit(_scatter_range, input_path, bounds[w], bounds[w + 1],
+                            temp_dir, w, num_partitions, stable_hash)
+            for w in range(num_workers)
+        ]
+        for future in scatter:
+            future.result()
+
+        # Фаза 2: дробление перегруженных партиций и параллельный подсчёт уникальных.
+        # Группы идут по убыванию размера по одной (chunksize=1): пачка из крупных
+        # задач, доставшаяся одному воркеру, снова дала бы хвост в конце фазы
+        partitions, sizes = _scan_partitions(temp_dir, num_partitions)
+        shift = (num_partitions - 1).bit_length()
+        groups = _rebalance(executor, partitions, sizes, shift, temp_dir, stable_hash)
+        total = sum(executor.map(count_unique_in_partition, [paths for paths, _ in groups],
+                                 [size for _, size in groups], chunksize=1))
 
     return total
 
 
+def _sort_range(input_path: str, start: int, end: int, temp_dir: str, worker_id: int,
+                run_keys: int) -> list:
+    """Фаза 1 режима sort для диапазона байт [start, end): ключи копятся в set до
+    run_keys уникальных, затем пишутся отсортированным прогоном без повторов
+    в run_{worker_id}_{n}.bin. Возвращает пути прогонов.
+    """
+    runs = []
+    keys = set()
+    recent = _new_recent()
+
+    def flush():
+        path = os.path.join(temp_dir, f"run_{worker_id:03d}_{len(runs):04d}.bin")
+        with open(path, 'wb') as f:
+            f.write(b''.join(sorted(keys)))
+        runs.append(path)
+        keys.clear()
+
+    for block in _iter_key_blocks(input_path, start, end):
+        block = _drop_recent(block, recent)
+        pos = 0
+        while pos < len(block):
+            # Не больше ключей, чем осталось места в прогоне: set не выходит за run_keys
+            stop = min(len(block), pos + 16 * (run_keys - len(keys)))
+            keys.update(block[i:i + 16] for i in range(pos, stop, 16))
+            pos = stop
+            if len(keys) >= run_keys:
+                flush()
+    if keys:
+        flush()
+    return runs
+
+
+def _map_run(path: str):
+    """Прогон только для чтения через mmap; файл сразу закрывается — при тысячах
+    прогонов не упираемся в лимит открытых дескрипторов.
+    """
+    with open(path, 'rb') as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _sample_run(path: str) -> list:
+    """Регулярная выборка SORT_SAMPLES_PER_RUN ключей прогона (равные шаги по позиции)."""
+    with _map_run(path) as mm:
+        n = len(mm) // 16
+        step = max(1, n // SORT_SAMPLES_PER_RUN)
+        return [mm[16 * i:16 * i + 16] for i in range(step // 2, n, step)]
+
+
+def _lower_bound(mm, key) -> int:
+    """Смещение первого ключа прогона >= key (двоичный поиск по записям по 16 байт);
+    key=None — конец прогона.
+    """
+    lo, hi = 0, len(mm) // 16
+    if key is None:
+        return 16 * hi
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if mm[16 * mid:16 * mid + 16] < key:
+            lo = mid + 1
+        else:
+            hi = mid
+    return 16 * lo
+
+
+def _sort_run_keys(num_workers: int) -> int:
+    """Размер прогона по умолчанию: set-ы всех воркеров в фазе 1 вместе укладываются
+    в SORT_MEMORY_BUDGET, но не больше SORT_RUN_KEYS.
+    """
+    return max(1024, min(SORT_RUN_KEYS, SORT_MEMORY_BUDGET // (num_workers * SORT_KEY_COST)))
+
+
+def _merge_block_size(num_runs: int, num_workers: int) -> int:
+    """Блок чтения одного прогона в фазе 2 (кратен 16): блоки всех прогонов у всех
+    воркеров вместе укладываются в SORT_MEMORY_BUDGET, но не больше PARTITION_READ_SIZE.
+    """
+    block = SORT_MEMORY_BUDGET // (num_workers * num_runs) // 16 * 16
+    return max(16, min(PARTITION_READ_SIZE, block))
+
+
+def _iter_run_keys(mm, start: int, stop: int, block_size: int):
+    """Ключи прогона в [start, stop) по одному, чтение блоками по block_size байт.
+    Прочитанные страницы отображения отпускаются (MADV_DONTNEED): иначе за время
+    слияния в памяти процесса оказались бы все прогоны целиком.
+    """
+    release = hasattr(mmap, 'MADV_DONTNEED')
+    page = mmap.PAGESIZE
+    for pos in range(start, stop, block_size):
+        end = min(stop, pos + block_size)
+        block = mm[pos:end]
+        first, last = pos // page * page, end // page * page
+        if release and last > first:
+            mm.madvise(mmap.MADV_DONTNEED, first, last - first)
+        yield from (block[i:i + 16] for i in range(0, len(block), 16))
+
+
+def _merge_count(runs: list, lo, hi, block_size: int = PARTITION_READ_SIZE) -> int:
+    """Фаза 2 режима sort: число различных ключей из [lo, hi) во всех прогонах.
+    Прогоны отсортированы, поэтому их слияние (heapq.merge) — отсортированный поток,
+    и повтор всегда стоит вплотную к предыдущему ключу. lo/hi=None — без границы.
+    В памяти — по блоку block_size на прогон (см. _merge_block_size).
+    """
+    maps = [_map_run(path) for path in runs]
+    try:
+        streams = [_iter_run_keys(mm, 0 if lo is None else _lower_bound(mm, lo),
+                                  _lower_bound(mm, hi), block_size) for mm in maps]
+        count = 0
+        prev = None
+        for key in heapq.merge(*streams):
+            if key != prev:
+                count += 1
+                prev = key
+        return count
+    finally:
+        for mm in maps:
+            mm.close()
+
+
+def count_unique_sorted(input_path: str, temp_dir: str, num_workers: int = 0,
+                        run_keys: int = 0) -> int:
+    """Режим внешней сортировки: альтернатива разбиению по хешу.
+
+    Алгоритм (по схеме PSRS — параллельная сортировка с регулярной выборкой):
+    1. Каждый воркер читает свой диапазон байт и пишет отсортированные прогоны
+       уникальных ключей (_sort_range) — запись и чтение только последовательные
+    2. Из каждого прогона берётся регулярная выборка, по ней выбираются
+       num_workers - 1 границ, делящих пространство ключей на диапазоны примерно
+       равного объёма
+    3. Каждый воркер сливает свой диапазон из всех прогонов и считает различные
+       соседние ключи (_merge_count); диапазоны не пересекаются, результаты суммируются
+
+    Память ограничена SORT_MEMORY_BUDGET на все воркеры в обеих фазах: в фазе 1 —
+    set не больше run_keys ключей (0 — _sort_run_keys), в фазе 2 — по блоку
+    _merge_block_size на прогон, сколько бы прогонов ни оказалось.
+    """
+    num_workers = _resolve_workers(num_workers)
+    run_keys = run_keys or _sort_run_keys(num_workers)
+    input_size = os.path.getsize(input_path)
+    bounds = [input_size * i // num_workers for i in range(num_workers + 1)]
+
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        runs = []
+        for worker_runs in executor.map(_sort_range, [input_path] * num_workers, bounds[:-1],
+                                        bounds[1:], [temp_dir] * num_workers, range(num_workers),
+                                        [run_keys] * num_workers):
+            runs.extend(worker_runs)
+        if not runs:
+            return 0
+
+        samples = sorted(key for sample in executor.map(_sample_run, runs) for key in sample)
+        pivots = [samples[len(samples) * i // num_workers] for i in range(1, num_workers)]
+        ranges = list(zip([None] + pivots, pivots + [None]))
+        block_size = _merge_block_size(len(runs), num_workers)
+        return sum(executor.map(_merge_count, [runs] * len(ranges), *zip(*ranges),
+                                [block_size] * len(ranges)))
+
+
 def main():
     """Точка входа: разбор аргументов, выбор режима, запись результата."""
     parser = argparse.ArgumentParser(
@@ -132,8 +761,14 @@ def main():
                         help='Всегда использовать режим партиционирования')
     parser.add_argument('--basic', action='store_true',
                         help='Всегда использовать in-memory режим')
+    parser.add_argument('--hybrid', action='store_true',
+                        help='Всегда использовать разбиение по хешу в памяти')
+    parser.add_argument('--sort', action='store_true',
+                        help='Подсчёт через внешнюю сортировку и слияние прогонов')
     parser.add_argument('--workers', type=int, default=0,
                         help='Количество рабочих процессов (0 — авто)')
+    parser.add_argument('--stable-hash', action='store_true',
+                        help='Разбиение по MD5 вместо CRC32 (медленнее, равномернее)')
     args = parser.parse_args()
 
     input_path = args.input_file
@@ -142,14 +777,27 @@ def main():
     if not os.path.isfile(input_path):
         raise SystemExit(f"Ошибка: файл не найден: {input_path}")
 
+    if args.hybrid and args.workers > 1:
+        raise SystemExit("Ошибка: режим --hybrid работает в одном процессе, --workers не применим")
+
+    input_size = os.path.getsize(input_path)
+    # Без диска — только при одном воркере: иначе параллельный режим партиций быстрее
+    use_hybrid = (input_size > MEMORY_MODE_THRESHOLD and _resolve_workers(args.workers) == 1
+                  and input_size * HYBRID_MEMORY_FACTOR < _available_memory())
     if args.basic:
         count = count_unique_basic(input_path)
-    elif args.optimized or os.path.getsize(input_path) > MEMORY_MODE_THRESHOLD:
+    elif args.sort:
+        with tempfile.TemporaryDirectory(prefix='ipv6_count_') as tmpdir:
+            count = count_unique_sorted(input_path, tmpdir, num_workers=args.workers)
+    elif args.hybrid or (use_hybrid and not args.optimized):
+        count = count_unique_hybrid(input_path, stable_hash=args.stable_hash)
+    elif args.optimized or input_size > MEMORY_MODE_THRESHOLD:
         with tempfile.TemporaryDirectory(prefix='ipv6_count_') as tmpdir:
             count = count_unique_optimized(
                 input_path,
                 tmpdir,
                 num_workers=args.workers,
+                stable_hash=args.stable_hash,
             )
     else:
         count = count_unique_basic(input_path)
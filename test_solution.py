@@ -4,17 +4,28 @@
 
 Проверки:
 - example_input.txt: пример из задания (5 строк -> 4 уникальных)
-- малый файл: basic и auto режимы
-- средний файл: optimized режим
+- малый файл: basic и auto режимы, обрезка пробелов по краям строк
+- средний файл: optimized, hybrid и sort режимы
+- sort с несколькими прогонами на воркер: слияние прогонов по диапазонам ключей
+- перекос по партициям: дробление перегруженной партиции в режиме optimized
+- C-библиотека (если есть компилятор): разбор против inet_pton, режимы с ней и без неё
 """
+import ctypes
+import importlib.util
 import os
+import random
+import shutil
+import socket
 import subprocess
 import sys
+import tempfile
+import zlib
 
 
-def run_count(input_path: str, output_path: str, args: list = None) -> int:
+def run_count(input_path: str, output_path: str, args: list = None,
+              script: str = 'count_unique_ipv6.py') -> int:
     """Запуск count_unique_ipv6, возврат числа из output-файла."""
-    cmd = [sys.executable, 'count_unique_ipv6.py', input_path, output_path]
+    cmd = [sys.executable, script, input_path, output_path]
     if args:
         cmd.extend(args)
     subprocess.run(cmd, check=True)
@@ -39,22 +50,203 @@ def test_generated_small():
     assert result_basic == 100
     assert result_auto == 100
     print("[OK] Малый файл (500 строк, 100 уникальных): оба режима корректны")
+    test_line_whitespace()
+    print("[OK] Пробелы по краям строк обрезаются, пробел внутри адреса — ошибка")
+
+
+def test_line_whitespace(script: str = 'count_unique_ipv6.py'):
+    """Края строк обрезаются (пробелы, табуляции, \\r\\n), пустые строки пропускаются,
+    а строка с пробелом внутри — ошибка, а не два адреса.
+    """
+    with open('test_spaces.txt', 'wb') as f:
+        f.write(b'  ::1 \r\n\t2001:db8::1\n\n::1\r\n2001:DB8:0::1\t\n')
+    result = run_count('test_spaces.txt', 'test_out_spaces.txt', ['--basic'], script=script)
+    assert result == 2, f"Ожидалось 2, получено {result}"
+    with open('test_spaces.txt', 'wb') as f:
+        f.write(b'::1\n1::2 3::4\n')
+    rejected = subprocess.run([sys.executable, script, 'test_spaces.txt', 'test_out_spaces.txt',
+                               '--basic'], stderr=subprocess.DEVNULL)
+    assert rejected.returncode != 0, "Строка '1::2 3::4' должна отклоняться"
 
 
 def test_generated_optimized():
-    """Проверка режима партиций на 5k уникальных, 25k строк."""
+    """Проверка режима партиций на 5k уникальных, 25k строк (CRC32 и MD5)."""
     subprocess.run([
         sys.executable, 'generate_ipv6_data.py', 'test_medium.txt', '5000', '25000'
     ], check=True)
     result = run_count('test_medium.txt', 'test_out_opt.txt', ['--optimized'])
     assert result == 5000
-    print("[OK] Оптимизированный режим: 5000 уникальных")
+    result_md5 = run_count('test_medium.txt', 'test_out_opt.txt', ['--optimized', '--stable-hash'])
+    assert result_md5 == 5000
+    print("[OK] Режим optimized (CRC32 и MD5): 5000 уникальных")
+
+
+def test_generated_hybrid():
+    """Режим hybrid на среднем файле из test_generated_optimized (CRC32 и MD5);
+    --hybrid с несколькими воркерами отклоняется — режим однопроцессный.
+    """
+    result = run_count('test_medium.txt', 'test_out_opt.txt', ['--hybrid'])
+    assert result == 5000
+    result_md5 = run_count('test_medium.txt', 'test_out_opt.txt', ['--hybrid', '--stable-hash'])
+    assert result_md5 == 5000
+    rejected = subprocess.run([sys.executable, 'count_unique_ipv6.py', 'test_medium.txt',
+                               'test_out_opt.txt', '--hybrid', '--workers', '2'],
+                              stderr=subprocess.DEVNULL)
+    assert rejected.returncode != 0, "--hybrid с --workers 2 должен отклоняться"
+    print("[OK] Режим hybrid (CRC32 и MD5): 5000 уникальных, --workers 2 отклонён")
+
+
+def test_generated_sort():
+    """Режим sort через командную строку на среднем файле из test_generated_optimized."""
+    result = run_count('test_medium.txt', 'test_out_opt.txt', ['--sort', '--workers', '3'])
+    assert result == 5000
+    print("[OK] Режим sort (3 воркера): 5000 уникальных")
+
+
+def test_sorted_runs():
+    """Режим sort с прогонами по 400 ключей: у каждого воркера несколько прогонов,
+    так что работают слияние heapq.merge, границы диапазонов и _lower_bound.
+    """
+    import count_unique_ipv6
+    subprocess.run([
+        sys.executable, 'generate_ipv6_data.py', 'test_runs.txt', '3000', '12000'
+    ], check=True)
+    with tempfile.TemporaryDirectory(prefix='ipv6_runs_test_') as tmp:
+        result = count_unique_ipv6.count_unique_sorted('test_runs.txt', tmp, num_workers=3,
+                                                       run_keys=400)
+        runs = [name for name in os.listdir(tmp) if name.startswith('run_')]
+    assert result == 3000, f"Ожидалось 3000, получено {result}"
+    for worker in range(3):
+        assert sum(name.startswith(f'run_{worker:03d}_') for name in runs) > 1
+    print(f"[OK] Режим sort, {len(runs)} прогонов у 3 воркеров: 3000 уникальных")
+
+
+def test_skewed_partition():
+    """Большинство адресов — в одной партиции по CRC32 (младшие 6 бит, 64 партиции):
+    она намного крупнее медианы и дробится _split_partition, ответ не меняется.
+    """
+    rng = random.Random(2)
+    hot, cold = [], []
+    while len(hot) < 12000 or len(cold) < 3000:
+        key = rng.getrandbits(128).to_bytes(16, 'big')
+        target = hot if zlib.crc32(key) & 63 == 0 else cold
+        if len(target) < (12000 if target is hot else 3000):
+            target.append(socket.inet_ntop(socket.AF_INET6, key))
+    lines = hot + cold
+    rng.shuffle(lines)
+    with open('test_skewed.txt', 'w') as f:
+        f.write('\n'.join(lines + lines[:5000]) + '\n')
+    result = run_count('test_skewed.txt', 'test_out_skewed.txt', ['--optimized', '--workers', '2'])
+    assert result == 15000, f"Ожидалось 15000, получено {result}"
+    print("[OK] Перекос по партициям: перегруженная партиция раздроблена, 15000 уникальных")
+
+
+# Граничные формы записи: и допустимые, и ошибочные — ответ сверяется с inet_pton
+SIMD_FORMS = [
+    '::', '1::', '::1', '0::0', ':::', '1:::2', '::1::', '1:2:3:4:5:6:7::', '::2:3:4:5:6:7:8',
+    '1:2:3:4::5:6:7:8', '1:2:3:4:5:6:7:8', '1:2:3:4:5:6:7:8:9', '2001:db8::1',
+    '2001:0db8:0000:0000:0000:0000:0000:0001', 'ABCD:EF01::1', 'abcd:EF01:0:0::Cafe',
+    '12345::', 'g::', '1:2', ':1::', '1::2:', '::ffff:1.2.3.4', '::1.2.3.4',
+    '1:2:3:4:5:6:1.2.3.4', '::ffff:1.2.3', '::ffff:256.1.1.1',
+]
+
+
+def _load_module(path: str):
+    """Загрузка копии count_unique_ipv6 из path (со своей _ipv6_simd.so рядом или без)."""
+    spec = importlib.util.spec_from_file_location('count_unique_ipv6_copy', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _pton(line: str):
+    """Ожидаемый ключ: inet_pton или None для ошибочной записи."""
+    try:
+        return socket.inet_pton(socket.AF_INET6, line)
+    except OSError:
+        return None
+
+
+def test_simd_library():
+    """Сборка _ipv6_simd.so во временном каталоге: parse_batch и _canon_batch против
+    inet_pton, затем режимы копии программы с библиотекой, без неё и с устаревшей
+    сборкой, в которой нет части функций.
+    """
+    cc = shutil.which('cc')
+    if cc is None:
+        print("[SKIP] Компилятор C не найден: _ipv6_simd.c не проверяется")
+        return
+    with tempfile.TemporaryDirectory(prefix='ipv6_simd_test_') as tmp:
+        with_lib, without_lib = os.path.join(tmp, 'lib'), os.path.join(tmp, 'nolib')
+        for d in (with_lib, without_lib):
+            os.mkdir(d)
+            shutil.copy('count_unique_ipv6.py', d)
+        lib_path = os.path.join(with_lib, '_ipv6_simd.so')
+        build = [cc, '-O3', '-shared', '-fPIC', '-o', lib_path, '_ipv6_simd.c']
+        # -mssse3 есть только на x86; без него собирается скалярный вариант
+        if subprocess.run(build[:2] + ['-mssse3'] + build[2:]).returncode:
+            subprocess.run(build, check=True)
+
+        module = _load_module(os.path.join(with_lib, 'count_unique_ipv6.py'))
+        assert module._SIMD is not None, "Собранная библиотека не загрузилась"
+        for form in SIMD_FORMS:
+            expected = _pton(form)
+            line = form.encode()
+            buf = ctypes.create_string_buffer(line + b'\n', len(line) + 1 + module._SIMD_PADDING)
+            out = ctypes.create_string_buffer(16)
+            if module._SIMD.parse_batch(buf, 1, out):
+                # C-код может отдать строку inet_pton, но не вправе разобрать её иначе
+                assert out.raw == expected, f"parse_batch({form!r}) = {out.raw.hex()}"
+            else:
+                assert '.' in form or expected is None, f"parse_batch не разобрал {form!r}"
+            try:
+                got = module._canon_batch([line])
+            except ValueError:
+                got = None
+            assert got == expected, f"_canon_batch({form!r}) = {got!r}"
+
+        # Пачка с IPv4-суффиксами в середине: продолжение разбора после запасного пути
+        rng = random.Random(1)
+        lines = [socket.inet_ntop(socket.AF_INET6, rng.getrandbits(128).to_bytes(16, 'big'))
+                 for _ in range(3000)]
+        for i in range(0, len(lines), 700):
+            lines[i] = f"::ffff:10.0.{i % 256}.1"
+        lines = [line.upper() if i % 3 else line for i, line in enumerate(lines)]
+        expected = b''.join(map(_pton, lines))
+        assert module._canon_batch([line.encode() for line in lines]) == expected
+
+        subprocess.run([
+            sys.executable, 'generate_ipv6_data.py', 'test_simd.txt', '2000', '10000'
+        ], check=True)
+        for mode in (['--basic'], ['--optimized', '--workers', '2'], ['--hybrid'],
+                     ['--sort', '--workers', '2']):
+            for d in (with_lib, without_lib):
+                result = run_count('test_simd.txt', 'test_out_simd.txt', mode,
+                                   script=os.path.join(d, 'count_unique_ipv6.py'))
+                assert result == 2000, f"{mode} в {os.path.basename(d)}: {result}"
+        for d in (with_lib, without_lib):
+            test_line_whitespace(script=os.path.join(d, 'count_unique_ipv6.py'))
+
+        # Библиотека из старой версии (нет set16_* и др.): запуск без неё, а не падение
+        stale_path = os.path.join(without_lib, '_ipv6_simd.so')
+        stale = subprocess.run([cc, '-shared', '-fPIC', '-o', stale_path, '-x', 'c', '-'],
+                               input=b'int parse_batch(void) { return 0; }\n')
+        if not stale.returncode:
+            module = _load_module(os.path.join(without_lib, 'count_unique_ipv6.py'))
+            assert module._SIMD is None, "Устаревшая библиотека не отброшена"
+            result = run_count('test_simd.txt', 'test_out_simd.txt', ['--basic'],
+                               script=os.path.join(without_lib, 'count_unique_ipv6.py'))
+            assert result == 2000
+    print("[OK] C-библиотека: разбор совпадает с inet_pton, режимы с ней, без неё "
+          "и с устаревшей сборкой: 2000")
 
 
 def cleanup():
     """Удаление временных файлов после тестов."""
     for f in ['test_output.txt', 'test_small.txt', 'test_out_basic.txt', 
-              'test_out_auto.txt', 'test_medium.txt', 'test_out_opt.txt']:
+              'test_out_auto.txt', 'test_medium.txt', 'test_out_opt.txt',
+              'test_simd.txt', 'test_out_simd.txt', 'test_skewed.txt', 'test_out_skewed.txt',
+              'test_runs.txt', 'test_spaces.txt', 'test_out_spaces.txt']:
         if os.path.exists(f):
             os.remove(f)
 
@@ -65,6 +257,11 @@ if __name__ == '__main__':
         test_example()
         test_generated_small()
         test_generated_optimized()
+        test_generated_hybrid()
+        test_generated_sort()
+        test_sorted_runs()
+        test_skewed_partition()
+        test_simd_library()
         print("\nВсе тесты пройдены.")
     finally:
         cleanup()